@@ -3,13 +3,22 @@
 
     This script downloads the requested quantities for specific frequency and time range.
     The data are downloaded as monthly-aggregated ".nc" file (the original downloaded files are zipped
-    but the script extract them in the corresponding year folder)
+    but the script extract them in the corresponding year folder, removes the zips and merges the parts of each month)
     For further info refer to : https://cds.climate.copernicus.eu/how-to-api)
 
     It depends on common libraries, please install al the deèendancies listed in "requirements.txt"
 
+    Each month is split in three ~10 days requests (smaller jobs are scheduled sooner by CDS). 
+    All requests are independent, so they are submitted concurrently through a bounded thread pool
+    (most of the time is spent waiting on the CDS queue and on the network, not on the CPU), 
+    then the parts of each month are merged in the monthly file.
+
     Functions:
     - extract_nc : Extract the .nc files from the zip file, rename it and save it into a user-selected folder
+    - is_complete_nc : Check that an extracted .nc file can be opened and covers the whole requested period
+    - n_hours : Number of hourly time steps requested for some days of a month
+    - fetch_part : Download (with retries) and extract the data of some days of a month
+    - merge_month : Merge the parts of a month in a single .nc file
 
     Author: Lorenzo Cane - DBL E&E Area Consultant
     Last Modified: 08/07/2025
@@ -17,7 +26,12 @@
 
 #Imports 
 import os
+import calendar
+from time import sleep
+import itertools
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from zipfile import ZipFile
+from tqdm import tqdm
 import xarray as xr
 import pandas as pd
 import cdsapi
@@ -33,18 +47,32 @@ os.makedirs(download_dir, exist_ok=True)
 dataset = 'reanalysis-era5-land'
 #Downloaded variables
 variables = [
-            '2m_temperature', 'snow_depth', 'surface_runoff' 'surface_pressure', 'sub_surface_runoff','surface_solar_radiation_downwards',
-			'total_evaporation', 'total_precipitation'
+            '2m_temperature', 'snow_depth', 'surface_runoff', 'surface_pressure', 'sub_surface_runoff',
+            'surface_solar_radiation_downwards', 'total_evaporation', 'total_precipitation'
             ]
+#ERA5-land variables known to this project: a missing comma joins two names into an unknown one
+#(add new variables here before requesting them)
+known_variables = {
+            '2m_dewpoint_temperature', '2m_temperature', 'leaf_area_index_high_vegetation', 'snow_density',
+            'snow_depth', 'surface_runoff', 'surface_pressure', 'sub_surface_runoff',
+            'surface_solar_radiation_downwards', 'total_evaporation', 'total_precipitation'
+            }
+assert set(variables) <= known_variables, f'Unknown ERA5 variable name(s): {sorted(set(variables) - known_variables)}'
 #time range definition
 years = list(range(2020, 2026)) # !!! last number is not included
 months = list(range(1, 13)) # (1,13) for full year (REMEMBER: last month is not included)
 days = [f"{d:02d}" for d in range(1, 32)] # !!! last number is not included: (1,32) for full month
+day_chunks = [days[:10], days[10:20], days[20:]] #one CDS request per chunk of days
 time = [f"{h:02d}:00" for h in range(24)] #Already in the ERA5 correct format
 
 #Area of Interest
 area = [44.5, 19.5, 43.5, 20.83]  # North, West, South, East
 
+#Parallel download settings
+max_workers = 6     # concurrent CDS requests (keep well below the CDS per-user queue limit, ~20 active requests)
+max_retries = 5     # attempts per request before giving up
+backoff_base = 30   # seconds, doubled at every failed attempt
+
 # -------------------------------------------------------------------------------------------
 #Function definition
 def extract_nc(zip_path, extracted_dir, target_name):
@@ -71,54 +99,226 @@ def extract_nc(zip_path, extracted_dir, target_name):
         Notes:
         ----------
         - This does not alter the content of the ZIP archive.
+        - Only .nc members are extracted (other files in the archive are skipped).
+        - Several .nc members (CDS splits the variables by step type, e.g. instant and accum) are merged 
+          in the single target file.
     '''
     with ZipFile(zip_path, 'r') as zip_ref:
-        for file in zip_ref.infolist():
-            filename = file.filename #needed by .extract
-            file.filename = target_name # Change the filename in memory (temporary change, does not alter the zip file itself)
-            zip_ref.extract(filename, path=extracted_dir)
+        nc_members = [file for file in zip_ref.infolist() if file.filename.endswith('.nc')]
+        if not nc_members:
+            raise ValueError(f'No .nc file found in {zip_path}')
+        if len(nc_members) == 1:
+            nc_members[0].filename = target_name # Change the filename in memory (temporary change, does not alter the zip file itself)
+            zip_ref.extract(nc_members[0], path=extracted_dir)
+        else:
+            #Extract each member under a temporary name, then merge their variables
+            member_paths = []
+            for i, file in enumerate(nc_members):
+                file.filename = f'{target_name}.member{i}'
+                member_paths.append(zip_ref.extract(file, path=extracted_dir))
+            datasets = [xr.open_dataset(path) for path in member_paths]
+            try:
+                xr.merge(datasets).to_netcdf(os.path.join(extracted_dir, target_name))
+            finally:
+                for ds, path in zip(datasets, member_paths):
+                    ds.close()
+                    os.remove(path)
     print(f'Extracted: {zip_path} into {extracted_dir}')
     
-# -------------------------------------------------------------------------------------------
-# Download loop
+def is_complete_nc(nc_path, expected_hours):
+    '''
+        Check if an extracted .nc file is readable and contains the expected number of time steps.
+
+        Parameters:
+        ----------
+        nc_path : str
+                Path to the .nc file.
+
+        expected_hours : int
+                Number of hourly time steps expected in the file.
 
-for year in years:
+        Return:
+        ----------
+        bool
+                True if the file exists, can be opened and is complete, False otherwise.
+    '''
+    if not os.path.exists(nc_path):
+        return False
+    try:
+        with xr.open_dataset(nc_path) as ds:
+            n_times = ds.sizes.get('valid_time', ds.sizes.get('time', 0))
+    except Exception as e:
+        print(f'Unable to read {nc_path}: {e}')
+        return False
+    return n_times == expected_hours
+
+def n_hours(year, month, day_list):
+    '''
+        Number of hourly time steps requested for the given days of a month (days not existing 
+        in the month, e.g. 30 February, are ignored).
+
+        Parameters:
+        ----------
+        year : int
+                Year of the request.
+
+        month : int
+                Month of the request (1-12).
+
+        day_list : list of str
+                Requested days ('01', '02', ...).
+
+        Return:
+        ----------
+        int
+                Expected number of time steps.
+    '''
+    n_days = sum(1 for d in day_list if int(d) <= calendar.monthrange(year, month)[1])
+    return n_days * len(time)
+
+def fetch_part(year, month, part):
+    '''
+        Download the ERA5-land data of a chunk of days of a month and extract the .nc file into the year folder.
+        Failed requests are retried with exponential backoff.
+
+        Parameters:
+        ----------
+        year : int
+                Year of the request.
+
+        month : int
+                Month of the request (1-12).
+
+        part : int
+                Index of the chunk of days in "day_chunks".
+
+        Return:
+        ----------
+        str
+                Path of the extracted .nc file.
+
+        Notes:
+        ----------
+        - A new CDS API client is created at every call, so the function can be safely run in parallel threads.
+        - A ValueError is raised if the extracted file does not cover all the requested hours, so that incomplete parts are never merged.
+    '''
     #year sub-folder into ERA5 data folder
     year_dir = os.path.join(download_dir, str(year))
     os.makedirs(year_dir, exist_ok=True)
-    
-    for month in months:
-        month_str = f"{month:02d}"
-        print("\n************************************************")
-        print(f"Year: {year}, Month: {month_str}")
-        print("************************************************")
-        #main part of name
-        name_file_base = f'ERA5_{year}_{month_str}'
-        name_file_base_path = os.path.join(year_dir, f'ERA5_{year}_{month_str}')
-        target_zip= f"{name_file_base}.zip"
-        target_nc = name_file_base + '.nc'
-        
-        # ERA5-land request
-        request = {
-            'product_type': 'reanalysis',
-            'variable': variables,
-            'year': year,
-            'month': month,
-            'day': days,
-            'time': time,
-            'area': area,
-            'format': 'netcdf'
-        }
-        
-        # Download
-        if not os.path.exists(target_zip): #do avoid useles download
-            print(f'Downloading {name_file_base}...')
-            # Set CDS API client
-            client = cdsapi.Client()
+
+    month_str = f"{month:02d}"
+    #main part of name
+    name_file_base = f'ERA5_{year}_{month_str}_part{part}'
+    target_zip= f"{name_file_base}.zip"
+    target_nc = name_file_base + '.nc'
+    part_nc = os.path.join(year_dir, target_nc)
+
+    #Skip parts already downloaded and extracted (partial/corrupt files are downloaded again)
+    expected_hours = n_hours(year, month, day_chunks[part])
+    if is_complete_nc(part_nc, expected_hours):
+        print(f'Already available: {part_nc}')
+        return part_nc
+    #A leftover zip is trusted only if it extracts to a complete part
+    if os.path.exists(target_zip):
+        print(f'Zip already exists: {target_zip}')
+        try:
+            extract_nc(target_zip, year_dir, target_nc)
+        except Exception as e:
+            print(f'Cannot extract {target_zip} ({e})')
+        os.remove(target_zip) #either a second copy of the data or a corrupt/partial zip: download it again
+        if is_complete_nc(part_nc, expected_hours):
+            return part_nc
+
+    # ERA5-land request
+    request = {
+        'product_type': 'reanalysis',
+        'variable': variables,
+        'year': year,
+        'month': month,
+        'day': day_chunks[part],
+        'time': time,
+        'area': area,
+        'format': 'netcdf'
+    }
+
+    # Download
+    print(f'Downloading {name_file_base}...')
+    # Set CDS API client
+    client = cdsapi.Client()
+    for attempt in range(max_retries):
+        try:
             client.retrieve(dataset, request, target_zip)
-        else:
-            print(f'Zip already exists: {target_zip}')
-                
-        #Extract and rename
-        extract_nc(target_zip, year_dir,target_nc)
-        
\ No newline at end of file
+            break
+        except Exception as e:
+            if attempt == max_retries - 1:
+                raise
+            wait = backoff_base * 2 ** attempt
+            print(f'Request {name_file_base} failed ({e}), retrying in {wait} s...')
+            sleep(wait)
+
+    #Extract and rename
+    extract_nc(target_zip, year_dir,target_nc)
+    #Once extracted the zip is only a second copy of the data on disk (or a bad one to download again)
+    os.remove(target_zip)
+    #An incomplete part must not be merged into the month
+    if not is_complete_nc(part_nc, expected_hours):
+        raise ValueError(f'Incomplete part {part_nc}: expected {expected_hours} time steps')
+
+    return part_nc
+
+def merge_month(year, month, part_paths):
+    '''
+        Merge the .nc files of the parts of a month in the monthly file and remove the parts.
+
+        Parameters:
+        ----------
+        year : int
+                Year of the parts.
+
+        month : int
+                Month of the parts (1-12).
+
+        part_paths : list of str
+                Paths of the .nc files of the parts.
+
+        Return:
+        ----------
+        str
+                Path of the monthly .nc file.
+    '''
+    year_dir = os.path.join(download_dir, str(year))
+    final_nc = os.path.join(year_dir, f'ERA5_{year}_{month:02d}.nc')
+
+    with xr.open_mfdataset(sorted(part_paths), combine='by_coords') as ds:
+        ds.to_netcdf(final_nc)
+    for path in part_paths:
+        os.remove(path)
+    print(f'Merged: {final_nc}')
+
+    return final_nc
+
+# -------------------------------------------------------------------------------------------
+# Download loop (one job per (year, month, chunk of days))
+
+#Skip months already downloaded and merged (partial/corrupt files are downloaded again)
+months_todo = [(year, month) for year, month in itertools.product(years, months)
+               if not is_complete_nc(os.path.join(download_dir, str(year), f'ERA5_{year}_{month:02d}.nc'),
+                                     n_hours(year, month, days))]
+parts_done = {ym: [] for ym in months_todo}
+
+with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    futures = {executor.submit(fetch_part, year, month, part): (year, month) 
+               for year, month in months_todo for part in range(len(day_chunks))}
+    for future in tqdm(as_completed(futures), total=len(futures), desc='ERA5 requests'):
+        year, month = futures[future]
+        try:
+            parts_done[(year, month)].append(future.result())
+        except Exception as e:
+            print(f'Failed to download part of {year}-{month:02d}: {e}')
+            continue
+        #All parts of the month available: merge them
+        if len(parts_done[(year, month)]) == len(day_chunks):
+            try:
+                merge_month(year, month, parts_done[(year, month)])
+            except Exception as e:
+                print(f'Failed to merge {year}-{month:02d}: {e}')
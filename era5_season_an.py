@@ -5,20 +5,22 @@
 # -------------------------------------------------------------------------------------------
 #Import libraries and utils
 import os
+from pathlib import Path
 import json
 import numpy as np
 import pandas as pd
 import xarray as xr 
-import seaborn as sns
+import pyarrow.parquet as pq
+import matplotlib
+matplotlib.use('Agg') #non-interactive backend: plots are only saved to file
 import matplotlib.pyplot as plt
 from tqdm import tqdm
-from statsmodels.tsa.seasonal import seasonal_decompose
 from statsmodels.graphics.tsaplots import plot_acf, plot_pacf
 import sys
 
 #custom utils
 sys.path.insert(0, './utils')
-from season_anal_utils import inspect_missing
+from season_anal_utils import inspect_missing, cached_seasonal_decompose
 
 # -------------------------------------------------------------------------------------------
 #Paths and global settings
@@ -26,8 +28,11 @@ sep = '-------------------------------------------------------------------------
 
 era5_variables = ['t2m', 'sde', 'ssro', 'ssrd', 'e', 'tp']
 preproc_dir = './preprocessed'
+era5_store = './preprocessed/era5_store.zarr' #chunked ERA5 store (section 4 of preprocessing.py)
+era5_dir = './ERA5_data' #monthly ERA5 files (used if the store is not available)
 img_dir = './img'
 os.makedirs(img_dir, exist_ok=True)
+cache_dir = './cache' #seasonal decompositions already computed
 
 station_id_map = './hydrometrological_data/station_id_name_map.txt'
 var_to_units_map = './preprocessed/var_to_units.txt'
@@ -46,7 +51,7 @@ print('Missing data in ERA5 dataset:')
 for file in os.listdir(preproc_dir):
     if file.endswith('flattened.parquet'):
         df = pd.read_parquet(os.path.join(preproc_dir, file))
-        missing_summary = inspect_missing(df)
+        missing_summary = inspect_missing(df, save_path=os.path.join(img_dir, file.replace('.parquet', '_missing.pdf')))
 
 print(sep)
 print('Missing data in river data:')
@@ -60,51 +65,76 @@ for file in os.listdir(preproc_dir):
 # -------------------------------------------------------------------------------------------
 #Seasonal decomposition 
 
+#Open the Zarr store lazily if available (grid means only read one time chunk at a time),
+#otherwise concatenate the monthly files virtually (lazy, no copy) or fall back on the flattened parquet files
+nc_files = sorted(Path(era5_dir).rglob('*.nc'))
+if os.path.exists(era5_store):
+    era5_ds = xr.open_zarr(era5_store, chunks={'valid_time': 744})
+elif nc_files:
+    era5_ds = xr.open_mfdataset(nc_files, combine='by_coords', chunks={'valid_time': 744})
+else:
+    era5_ds = None
+
+#Grid means (--> avg value in the selected area) of all variables in a single pass over the chunks
+grid_means = None
+if era5_ds is not None:
+    grid_means = era5_ds[era5_variables].mean(dim=('latitude', 'longitude')).reset_coords(drop=True).compute().to_dataframe()
+
 for variable in era5_variables:
     print(sep)
     print(f'ERA5 - {variable} : Time series decomposition')
     filename = f'era5_{variable}_flattened.parquet'
     units = var_unit_map[variable]['units']
     long_name = var_unit_map[variable]['long_name']
-    #find file
-    for file in os.listdir(preproc_dir):
-        if file == filename :
-            print(f'Found dataset...')
-            path = os.path.join(preproc_dir, file)
-
-            #Load dataset
-            df = pd.read_parquet(path)
-            if 'datetime' not in df.columns:
-                df.reset_index(inplace=True) #make datetime a column
-            df = df.dropna() # (I don't feel of to use fillna )
-
-            #Row-wise avg (--> avg value in the selected area, grid mean)
-            df[f'{variable}_mean'] = df.drop(columns='datetime').mean(axis=1)
-            mean =   df[f'{variable}_mean']
-            #Reset index
-            df.set_index('datetime')[f'{variable}_mean'].plot(title=f'ERA5 - {long_name} - Grid mean')
-            plt.ylabel(f'{long_name} [{units}]')
-            plt.xlabel('Time')
-            plt.tight_layout()
-            #Save results
-            img_name = f'{variable}_mean_over_grid.pdf'
-            img_path = os.path.join(img_dir, img_name)
-            plt.savefig(img_path)
-            print(f'Mean over time plot save to {img_path}')
-            #Clear plot
-            plt.clf()
-
-            seas_decomp = seasonal_decompose(mean, period=365)
-            seas_decomp.plot()
-            img_name = f'{variable}_seasonal_decomp.pdf'
-            img_path = os.path.join(img_dir, img_name)
-            plt.savefig(img_path)
-            print(f'Seasonal decomposition plot save to {img_path}')
-            #Clear plot
-            plt.clf()
-
-            plot_acf(mean)
-            plt.show()
+
+    if grid_means is not None:
+        mean = grid_means[variable].dropna().rename(f'{variable}_mean').rename_axis('datetime')
+    else:
+        #find file
+        path = os.path.join(preproc_dir, filename)
+        if not os.path.exists(path):
+            continue
+        print(f'Found dataset...')
+
+        #Load only datetime and grid cells of the variable (multithreaded reader, Arrow buffers freed while converting)
+        columns = [col for col in pq.read_schema(path).names if col == 'datetime' or col.startswith(f'{variable}_')]
+        df = pq.read_table(path, columns=columns, use_threads=True).to_pandas(split_blocks=True, self_destruct=True)
+        if 'datetime' not in df.columns:
+            df.reset_index(inplace=True) #make datetime a column
+        df = df.dropna() # (I don't feel of to use fillna )
+
+        #Row-wise avg (--> avg value in the selected area, grid mean) as a single NumPy reduction
+        grid_values = df[df.columns.difference(['datetime'])].to_numpy(dtype=np.float32, copy=False)
+        mean = pd.Series(grid_values.mean(axis=1), index=df['datetime'], name=f'{variable}_mean')
+
+    mean.plot(title=f'ERA5 - {long_name} - Grid mean')
+    plt.ylabel(f'{long_name} [{units}]')
+    plt.xlabel('Time')
+    plt.tight_layout()
+    #Save results
+    img_name = f'{variable}_mean_over_grid.pdf'
+    img_path = os.path.join(img_dir, img_name)
+    plt.savefig(img_path)
+    print(f'Mean over time plot save to {img_path}')
+    #Clear plot
+    plt.clf()
+
+    seas_decomp = cached_seasonal_decompose(mean, period=365, cache_dir=cache_dir, name=variable)
+    seas_decomp.plot()
+    img_name = f'{variable}_seasonal_decomp.pdf'
+    img_path = os.path.join(img_dir, img_name)
+    plt.savefig(img_path)
+    print(f'Seasonal decomposition plot save to {img_path}')
+    #Clear plot
+    plt.clf()
+
+    plot_acf(mean)
+    img_name = f'{variable}_acf.pdf'
+    img_path = os.path.join(img_dir, img_name)
+    plt.savefig(img_path)
+    print(f'Autocorrelation plot save to {img_path}')
+    #Close all the figures of this variable
+    plt.close('all')
 
 
 
@@ -2,15 +2,16 @@
     OCR Image Processor
 
     This script extracts hourly hydrometric data (e.g., flow or level) from a directory of scanned 
-    protocol images using OCR and saves the results into CSV files. It uses utility functions for 
+    protocol images using OCR and saves the results into Parquet files (zstd compressed). It uses utility functions for 
     image enhancement and text parsing defined in `img_to_csv_utils`.
 
     Workflow:
     ---------
     - Iterate through all `.jpg` images in the input folder (e.g., flow or level directories).
-    - Enhance images and extract tabular data using Tesseract OCR.
+    - Enhance images and extract tabular data using Tesseract OCR (images are processed in parallel, 
+      one worker process per CPU core, and OCR-ed in batches with one Tesseract call per batch).
     - Collect parsed values into a DataFrame.
-    - Save results to CSV.
+    - Save results to Parquet.
 
     Input:
     ------
@@ -18,7 +19,7 @@
 
     Output:
     -------
-    - Two CSV files: one for flow data, one for level data.
+    - Two Parquet files: one for flow data, one for level data.
 
     Dependencies:
     -------------
@@ -30,9 +31,11 @@
 """
 import os
 import sys
+import itertools
+from multiprocessing import Pool
 import pandas as pd 
 sys.path.insert(0, './utils')
-from img_to_csv_utils import enhance_image_for_ocr, extract_protok_data
+from img_to_csv_utils import enhance_image_for_ocr, extract_protok_batch
 
 input_img_dir = './img_tb_converted'
 flow_dir = './img_tb_converted/Protoci_maj_2025'
@@ -40,24 +43,29 @@ level_dir = './img_tb_converted/Nivoi_maj_2025'
 
 extracted_flow_data_dir = './flow_data'
 extracted_level_data_dir = './level_data'
-flow_file = "flow_may_2025.csv"
-level_file = "level_may_2025.csv"
+flow_file = "flow_may_2025.parquet"
+level_file = "level_may_2025.parquet"
 
 flow_path = os.path.join(extracted_flow_data_dir, flow_file)
 level_path = os.path.join(extracted_level_data_dir, level_file)
 
+ocr_batch_size = 8 #images OCR-ed by a single Tesseract call
+
 os.makedirs(extracted_flow_data_dir, exist_ok=True)
 os.makedirs(extracted_level_data_dir, exist_ok=True)
 
 #Extract flow data
-all_data = []
-for fname in sorted(os.listdir(flow_dir)):
-    if fname.endswith(".jpg"):
-        image_path = os.path.join(flow_dir, fname)
-        all_data.extend(extract_protok_data(image_path))
+if __name__ == '__main__': #needed by multiprocessing on spawn-based platforms
+    image_paths = [os.path.join(flow_dir, fname) for fname in sorted(os.listdir(flow_dir)) if fname.endswith(".jpg")]
+
+    batches = [image_paths[i:i + ocr_batch_size] for i in range(0, len(image_paths), ocr_batch_size)]
+
+    #Each image is independent: OCR the batches in parallel (imap keeps the file order)
+    with Pool(processes=os.cpu_count()) as pool:
+        all_data = list(itertools.chain.from_iterable(pool.imap(extract_protok_batch, batches)))
 
-df = pd.DataFrame(all_data, columns=["Date", "Value1", "Value2", "Value3"])
-df.to_csv(flow_path, index=False)
+    df = pd.DataFrame(all_data, columns=["Date", "Value1", "Value2", "Value3"])
+    df.to_parquet(flow_path, index=False, compression='zstd')
 
-print(f"Flow data saved in {flow_path}")
+    print(f"Flow data saved in {flow_path}")
 
@@ -3,14 +3,17 @@
 
     This script downloads daily hydrometrological data from the MeteoSRS online service for selected
     stations over a defined time range. The data is retrieved via HTTP POST requests, and parsed JSON
-    responses are stored in a structured folder hierarchy based on station and year.
+    responses are collected and stored in a structured folder hierarchy based on station and year.
 
     Workflow:
     ---------
-    - Retrieve mapping between station IDs and their associated names/basins.
+    - Retrieve mapping between station IDs and their associated names/basins (the saved map is 
+      reused if younger than a week, use `--refresh` to download it again).
     - For each station and each day within the defined date range:
-        - Query the online data endpoint.
-        - If data is present, save it in a JSON file named by date.
+        - Query the online data endpoint (days are requested in parallel threads sharing 
+          a single keep-alive HTTP session).
+        - If data is present, collect its records.
+    - Save the records of each station and year in a single Parquet file.
     - Store all files in an output directory, grouped by basin/station and year.
 
     Inputs:
@@ -22,12 +25,12 @@
     Outputs:
     --------
     - `station_id_name_map.txt`: JSON dictionary of ID-to-name/basin mapping.
-    - Daily `.json` files per station, organized by year.
+    - One `.parquet` file per station and year (`station_{ID}_{year}.parquet`).
 
     Dependencies:
     -------------
     - Python libraries
-    - import_data_utils (fetch_hydrometr_data, save_daily_data, get_station_id_basin_map) - custom module
+    - import_data_utils (create_session, fetch_hydrometr_data, save_yearly_data, get_station_id_basin_map) - custom module
 
 
     ATTENTION:
@@ -46,11 +49,19 @@ import json
 from datetime import datetime, timedelta
 import os
 import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 #custom utils
 sys.path.insert(0, './utils')
-from import_data_utils import fetch_hydrometr_data, save_daily_data, get_station_id_basin_map
+from import_data_utils import create_session, fetch_hydrometr_data, save_yearly_data, get_station_id_basin_map
 
 #----------------------------------------------------------------------------------------------
+parser = argparse.ArgumentParser(description='Download hydrometrological data from meteos.rs')
+parser.add_argument('--refresh', action='store_true', 
+                    help='download the station ID map again even if a recent copy is saved')
+args = parser.parse_args()
+
 sep = '=================================================='
 
 #Output dirictory and filename
@@ -58,6 +69,7 @@ output_dir = "./hydrometrological_data"
 os.makedirs(output_dir, exist_ok=True)
 id_name_file = 'station_id_name_map.txt' #ID-name map file
 id_file_path = os.path.join(output_dir, id_name_file)
+id_map_max_age = 7 * 86400 #seconds before the saved ID map is downloaded again
 
 #Station config and API endpoints
 station_ids = [239]   # [236, 237, 238, 239, 240]  # Add other known station IDs
@@ -70,16 +82,42 @@ end_date = datetime(2020,1,1)
 
 delta_t = timedelta(days=1)
 
+#Parallel requests (the loop is network bound)
+max_workers = 8
+session = create_session(pool_size=max_workers)
+
 
 #----------------------------------------------------------------------
-#Create a map between station IDs, names and basins
-map_dict = get_station_id_basin_map(station_map_url)
-#print(map_dict)
-with open(id_file_path, 'w', encoding="utf-8") as file:
-    json.dump(map_dict, file, indent=2, ensure_ascii=False)
-print(f'Station IDs map created and saved in {id_file_path}')
+#Create a map between station IDs, names and basins (station registry is static: reuse the saved one)
+map_is_recent = os.path.exists(id_file_path) and time.time() - os.path.getmtime(id_file_path) < id_map_max_age
+map_dict = None
+if args.refresh or not map_is_recent:
+    map_dict = get_station_id_basin_map(station_map_url, session=session)
+    #print(map_dict)
+    if map_dict:
+        with open(id_file_path, 'w', encoding="utf-8") as file:
+            json.dump(map_dict, file, indent=2, ensure_ascii=False)
+        print(f'Station IDs map created and saved in {id_file_path}')
+    elif os.path.exists(id_file_path):
+        print('Unable to download station IDs map, using the saved one')
+
+if not map_dict:
+    with open(id_file_path, encoding="utf-8") as file:
+        map_dict = json.load(file)
+    print(f'Station IDs map loaded from {id_file_path}')
 print(sep)
 
+# ----------------------------------------------------------------------
+def fetch_day(station, date):
+    '''
+        Fetch one day of data for a station, returning the raised exception (if any) 
+        instead of propagating it, so that one failing day does not stop the others.
+    '''
+    try:
+        return fetch_hydrometr_data(data_url, station, date, session=session)
+    except Exception as e:
+        return e
+
 # ----------------------------------------------------------------------
 # Main loop - Save hydrometrological data for the selected stations 
 for station in station_ids:
@@ -88,29 +126,36 @@ for station in station_ids:
     print(f'Fetching station {st_basin} - {station} data...')
     
     total_days = (end_date - start_date).days + 1
-    # Reset current date to start date
-    cur_date = start_date
+    all_dates = [start_date + i * delta_t for i in range(total_days)]
+    yearly_records = {} #year: list of records
 
-    with tqdm(total=total_days, desc=f"Station {station} ({st_basin})") as pbar:
+    with tqdm(total=total_days, desc=f"Station {station} ({st_basin})", mininterval=1.0, miniters=10) as pbar, \
+         ThreadPoolExecutor(max_workers=max_workers) as executor:
 
-        while cur_date <= end_date:
+        #Results are returned in date order
+        results = executor.map(lambda d: fetch_day(station, d), all_dates)
+        for cur_date, json_data in zip(all_dates, results):
             try:
-                json_data = fetch_hydrometr_data(data_url, station, cur_date)
+                if isinstance(json_data, Exception):
+                    raise json_data
                 # No data exception
                 if "rec" in json_data and json_data["rec"]:
-                    # Directory structure: ./output_dir/{station name - ID}/{year}/
-                    year_str = str(cur_date.year)
-                    station_dir = f"{st_basin} - {station}"
-                    station_path = os.path.join(output_dir, station_dir, year_str)
-                    os.makedirs(station_path, exist_ok=True)
-                
-                    save_daily_data(json_data, station, cur_date, station_path)
+                    yearly_records.setdefault(cur_date.year, []).extend(json_data["rec"])
                 else:
                     print(f'No data for station {st_basin} - {station} on {cur_date.date()}')
 
             except Exception as e:
                     print(f'Error in station {st_basin} - {station} on {cur_date.date()} : {e}')
         
-            cur_date += delta_t
             pbar.update(1)
-        print(f'--------------------------')
+
+    #One file per station and year
+    for year, records in yearly_records.items():
+        # Directory structure: ./output_dir/{station name - ID}/{year}/
+        station_dir = f"{st_basin} - {station}"
+        station_path = os.path.join(output_dir, station_dir, str(year))
+        os.makedirs(station_path, exist_ok=True)
+
+        save_path = save_yearly_data(records, station, year, station_path)
+        print(f'Station {st_basin} - {station} data of {year} saved to {save_path}')
+    print(f'--------------------------')
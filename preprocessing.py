@@ -6,9 +6,10 @@
     river level data, preparing them for machine learning model training.
 
     Main features:
-    - Flatten ERA5 NetCDF variables and save them to columnar format (optional).
-    - Create PyTorch-like tensors of ERA5 variables for time-series modeling (optional).
+    - Flatten ERA5 NetCDF variables and save them to columnar format, and create PyTorch-like tensors
+      of the same variables for time-series modeling, saved as chunked Zarr arrays (optional, single pass).
     - Filter and merge river level measurements into one aligned DataFrame (optional).
+    - Store all ERA5 variables in a single chunked, int16-packed and compressed Zarr store for lazy analysis (optional).
 
     Note:
     - Sections are optional and can be skipped 
@@ -22,16 +23,19 @@
 # -------------------------------------------------------------------------------------------
 #Import libraries and utils
 import os
+from pathlib import Path
 import numpy as np
 import pandas as pd
 import xarray as xr
+import dask
 import json
-from functools import reduce
+import zarr
+from numcodecs import Blosc
 from tqdm import tqdm
 import sys
 #custom utils
 sys.path.insert(0, './utils')
-from preproc_utils import (load_hydro_data, flat_ERA5_data, get_flat_index_to_coords, 
+from preproc_utils import (load_hydro_data, flat_ERA5_data, get_flat_index_to_coords, get_flat_coords_array,
                            tensor_ERA5_pytorch, filter_river_data, rename_column,
                             get_unit_longname)
 
@@ -43,6 +47,8 @@ era5_variables = ['t2m', 'sde', 'ssro', 'ssrd', 'e', 'tp']
 hydrometr_dir = './hydrometrological_data' #hydrometrological data main folder
 hydro_subdir_names = []
 era5_dir = './ERA5_data' #ERA5 data main folder
+#Monthly ERA5 files sorted chronologically (yyyy/ERA5_yyyy_mm.nc)
+nc_files = sorted(Path(era5_dir).rglob('*.nc'))
 
 
 preproc_dir = './preprocessed'
@@ -69,6 +75,10 @@ map_path = os.path.join(preproc_dir, map_filename)
 with open(map_path, 'w') as f:
     f.write(json.dumps(index_to_coord))
 
+#Same map as arrays: lat[idx], lon[idx] (indexed lookups, no JSON parsing)
+lat_flat, lon_flat = get_flat_coords_array(ds)
+np.savez(os.path.join(preproc_dir, 'coords.npz'), lat=lat_flat, lon=lon_flat)
+
 #Create short name-(unit, long_name) map
 unit_long_name_dict = {}
 map_filename = 'var_to_units.txt'
@@ -85,60 +95,62 @@ for variable in era5_variables:
 with open(map_path, 'w') as f :
     f.write(json.dumps(unit_long_name_dict))
 
+#Example file opened once for all the maps above
+ds.close()
+
 #********************************************************************************************
-# 1) ERA5 flattened version
+# 1-2) ERA5 flattened and grid versions
 '''
-#Loop through all variables
+#All NetCDF files as a single lazy dataset (files opened and read in parallel by dask)
+ds_era5 = xr.open_mfdataset(nc_files, combine='by_coords', parallel=True, chunks={'valid_time': 744})
+timestamps = pd.to_datetime(ds_era5['valid_time'].values) #already datetime64[ns], no parsing
+#Files are combined by coordinate, so time is normally already sorted: reorder (a copy) only if needed
+if timestamps.is_monotonic_increasing:
+    time_order = slice(None)
+else:
+    time_order = np.argsort(timestamps.asi8, kind='stable')
+    timestamps = timestamps[time_order]
+
+#Loop through all variables: each variable is read once and used for both outputs
 for var in tqdm(era5_variables):
     print(sep)
     print(f'Working on variable {var}....')
 
-    #empty array to store partial records
-    all_records = []
-    #output file name
-    output_name = f'era5_{var}_flattened.parquet'
-    output_file = os.path.join(preproc_dir, output_name)
+    #output file names
+    flat_file = os.path.join(preproc_dir, f'era5_{var}_flattened.parquet')
+    tensor_path = os.path.join(preproc_dir, f'era5_{var}_tensor.zarr')
 
-    #Loop through all NetCDF files
-    for root, dirs, files in os.walk(era5_dir):
-        for file in files:
-            if file.endswith('.nc'):
-                file_path = os.path.join(root, file)
-                print(f'Processing file: {file_path}')
+    #Values of shape (time, lat, long), time ordered
+    var_values = ds_era5[var].values[time_order].astype(np.float32, copy=False) #no copy if already float32
 
-                record = flat_ERA5_data(file_path, var)
-                all_records.extend(record)
+    #1) FLATTEN move on lat then long (north 2 south , then west 2 east): (time, lat*long)
+    values = var_values.reshape(var_values.shape[0], -1)
 
-
-    #to Dataframe and save
-    df = pd.DataFrame(all_records)
-    df["datetime"] = pd.to_datetime(df["datetime"])
-    df = df.sort_values("datetime").reset_index(drop=True)
+    #to Dataframe (built from one contiguous array) and save
+    df = pd.DataFrame(values, columns=[f'{var}_{j}' for j in range(values.shape[1])])
+    df.insert(0, 'datetime', timestamps)
     print(f'Check Dataframe variable {var}:')
     print(df.head(10))
 
-    df.to_parquet(output_file, index=False)
+    #zstd compression, row groups of 8784 rows (a leap year of hours, not aligned to calendar boundaries):
+    #datetime filters can still skip the row groups outside the requested range on read
+    df.to_parquet(flat_file, index=False, compression='zstd', row_group_size=8784)
 
-    print(f'Flattened data file of {var} saved to {output_file}')
-'''
-#********************************************************************************************
-# 2) ERA5 grid version 
-'''
-#Loop through all variables
-for var in tqdm(era5_variables):
-    print(sep)
-    print(f'Working on variable {var}....')
-
-    output_name = f'era5_{var}_tensor.npz'
-    output_path =  os.path.join(preproc_dir, output_name)
+    print(f'Flattened data file of {var} saved to {flat_file}')
 
-    var_tens, var_timestamp = tensor_ERA5_pytorch(era5_dir, var)
+    #2) Tensor of shape (N, 1, H, W) (a view on the same values, no copy)
+    var_tens = var_values[:, np.newaxis, :, :]
 
-    #Save results in NumpyZip format
-    np.savez_compressed(output_path, tensor=var_tens, timestamps=np.array(var_timestamp, dtype='datetime64[ns]'))
+    #Save results in Zarr format: one chunk per month (slices can be read without loading everything), 
+    #zstd + bit-shuffle compression run by blosc threads
+    root = zarr.open_group(tensor_path, mode='w')
+    root.create_dataset('tensor', data=var_tens, chunks=(744, 1, *var_tens.shape[2:]),
+                        compressor=Blosc(cname='zstd', clevel=3, shuffle=Blosc.BITSHUFFLE))
+    root.create_dataset('timestamps', data=np.array(timestamps, dtype='datetime64[ns]'))
 
-    print(f'Tensor for variable {var} saved to {output_path}')
+    print(f'Tensor for variable {var} saved to {tensor_path}')
 
+ds_era5.close()
 '''    
 
 '''
@@ -147,12 +159,12 @@ for var in tqdm(era5_variables):
 IMPORTANT NOTES
 **************************************************************************
 **************************************************************************
-Always use timestamp and tensor together: data in tensor are not time ordered.
+Always use timestamp and tensor together (data in tensor are now time ordered, 
+but files produced by older versions are not).
 Timestamp as been saved as datatime64. While loading use:
-    data = np.load("*.npz", allow_pickle=True)
-    tensor = data["tensor"]                   # shape: (N, 1, H, W)
-    timestamps = data["timestamps"].tolist()  # list of datetime64
-    timestamps = pd.to_datetime(timestamps)
+    data = zarr.open_group("*.zarr", mode="r")
+    tensor = data["tensor"][:]                # shape: (N, 1, H, W) (or a slice, e.g. data["tensor"][:744])
+    timestamps = pd.to_datetime(data["timestamps"][:])
 '''
 
 #********************************************************************************************
@@ -175,9 +187,8 @@ for code in river_codes:
     river_df = filter_river_data(hydrometr_dir, code)
 
     if river_df is not None:
-        #Sort and save
-        river_df= river_df.sort_values('datetime').reset_index(drop=True)
-        river_df.to_parquet(output_path, index = False)
+        #Save (already datetime sorted)
+        river_df.to_parquet(output_path, index = False, compression='zstd')
         #Visual check
         print(river_df.head(10))
         if code not in excluded_stations:
@@ -190,13 +201,49 @@ for code in river_codes:
 print(sep)
 print('Merging tributaries data...')
 
-merged_df = reduce(lambda left, right: pd.merge(left, right, on="datetime", how="outer"), all_river_dfs)
-merged_df = merged_df.sort_values("datetime").reset_index(drop=True)
+#Single outer alignment on the datetime index (datetimes are unique per river, columns named by river code)
+merged_df = pd.concat([df.set_index('datetime') for df in all_river_dfs], axis=1, join='outer')
+merged_df = merged_df.sort_index().rename_axis('datetime').reset_index()
 
 print(merged_df.head(10))
 
 #Save
-merged_df.to_parquet(merged_file_path, index=False)
+merged_df.to_parquet(merged_file_path, index=False, compression='zstd')
 print(f'Merged data saved to {merged_file_path}')
 
-'''
\ No newline at end of file
+'''
+
+#********************************************************************************************
+# 4) ERA5 chunked Zarr store
+'''
+zarr_store = os.path.join(preproc_dir, 'era5_store.zarr')
+chunk_time = 744 #hours in a 31 days month: one chunk per month, full grid in each chunk
+compressor = Blosc(cname='zstd', clevel=3, shuffle=Blosc.SHUFFLE)
+
+#Open all months as one lazy dataset (each file is indexed once) and rechunk on a regular
+#time grid so that dask chunks match the Zarr chunks and are written in parallel
+ds = xr.open_mfdataset(nc_files, combine='by_coords', chunks={'valid_time': chunk_time})
+ds = ds[era5_variables].drop_vars(['number', 'expver'], errors='ignore')
+ds = ds.chunk({'valid_time': chunk_time, 'latitude': -1, 'longitude': -1})
+
+#Pack values as int16 with scale_factor/add_offset (CF convention, as in the CDS netCDF files):
+#the variable range is split in 65534 levels, xarray unpacks them transparently while reading
+#(min and max computed together: the archive is read only once)
+vmin, vmax = dask.compute(ds.min(), ds.max())
+ny, nx = ds.sizes['latitude'], ds.sizes['longitude']
+encoding = {}
+for var in era5_variables:
+    lo, hi = float(vmin[var]), float(vmax[var])
+    if np.isnan(lo) or np.isnan(hi) or hi == lo:
+        #All-NaN or constant variable: no range to pack, keep it as float32
+        print(f'{var}: all-NaN or constant, saved as float32')
+        encoding[var] = {'chunks': (chunk_time, ny, nx), 'compressor': compressor, 'dtype': 'float32'}
+        continue
+    encoding[var] = {'chunks': (chunk_time, ny, nx), 'compressor': compressor,
+                     'dtype': 'int16', 'scale_factor': (hi - lo) / 65534,
+                     'add_offset': (hi + lo) / 2, '_FillValue': -32768}
+ds.to_zarr(zarr_store, mode='w', encoding=encoding)
+ds.close()
+
+print(f'ERA5 Zarr store saved to {zarr_store}')
+'''
@@ -1,31 +1,55 @@
 #!/usr/bin/env python
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import cdsapi
 
 years = list(range(2023, 2024))
 months = list(range(2, 13))
+max_workers = 8 #monthly requests queued on CDS at the same time
 
-for cds_year in years:
-	for cds_month in months:
+variables = [
+	'2m_dewpoint_temperature', '2m_temperature', 'leaf_area_index_high_vegetation', 'snow_depth', 'snow_density',
+	'surface_runoff', 'surface_pressure', 'sub_surface_runoff','surface_solar_radiation_downwards',
+	'total_evaporation', 'total_precipitation'
+]
+#ERA5-land variables known to this project: a missing comma joins two names into an unknown one
+#(add new variables here before requesting them)
+known_variables = {
+	'2m_dewpoint_temperature', '2m_temperature', 'leaf_area_index_high_vegetation', 'snow_density',
+	'snow_depth', 'surface_runoff', 'surface_pressure', 'sub_surface_runoff',
+	'surface_solar_radiation_downwards', 'total_evaporation', 'total_precipitation'
+}
+assert set(variables) <= known_variables, f'Unknown ERA5 variable name(s): {sorted(set(variables) - known_variables)}'
+
+#One CDS client per worker thread, reused for all its requests
+thread_data = threading.local()
+
+def get_client():
+	if not hasattr(thread_data, 'client'):
+		thread_data.client = cdsapi.Client()
+	return thread_data.client
+
+def retrieve_month(cds_year, cds_month):
+	name_month = str(cds_month)
+	if cds_month < 10: name_month = '0' + str(cds_month)
+	
+	name_dir = 	str(cds_year) + '/'
+	name_file = name_dir + 'ERA5L_'+ str(cds_year) + '_'+ name_month + '_varselec1.netcdf.zip'
 	
-		print("************************************************")
-		print("year: ", cds_year, ", month: ", cds_month)
-		print("************************************************")
-		
-		name_month = str(cds_month)
-		if cds_month < 10: name_month = '0' + str(cds_month)
-		
-		name_dir = 	str(cds_year) + '/'
-		name_file = name_dir + 'ERA5L_'+ str(cds_year) + '_'+ name_month + '_varselec1.netcdf.zip'
-		
-		c = cdsapi.Client()
-		c.retrieve(
+	if os.path.exists(name_file):
+		print("already downloaded: ", name_file)
+		return
+	
+	print("************************************************")
+	print("year: ", cds_year, ", month: ", cds_month, " requested")
+	print("************************************************")
+	
+	try:
+		get_client().retrieve(
 	    	'reanalysis-era5-land',
 	    	{
-	    	    'variable': [
-	    	        '2m_dewpoint_temperature', '2m_temperature', 'leaf_area_index_high_vegetation', 'snow_depth', '	snow_density'
-					'surface_runoff' 'surface_pressure', 'sub_surface_runoff','surface_solar_radiation_downwards',
-					'total_evaporation', 'total_precipitation'
-	    	    ],
+	    	    'variable': variables,
 	    	    'year': cds_year,
 	    	    'month': cds_month,
 	    	    'day': [
@@ -57,5 +81,12 @@ for cds_year in years:
 	    	    ],
 	    	    'format': 'netcdf.zip',
 	    	},
-	    	name_file)
+		    	name_file)
+		print(f"downloaded: {name_file}")
+	except Exception as e:
+		print(f"failed: {name_file}: {e}")
 
+#Submit all the months at once: requests wait in the CDS queue in parallel
+jobs = [(cds_year, cds_month) for cds_year in years for cds_month in months]
+with ThreadPoolExecutor(max_workers=max_workers) as executor:
+	list(executor.map(lambda job: retrieve_month(*job), jobs))
@@ -0,0 +1,27 @@
+import os
+import sys
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'utils'))
+from preproc_utils import load_hydro_data
+
+
+def test_load_hydro_data_mixed_csv_parquet(tmp_path):
+    #Legacy daily CSV (YYYYMMDD in the name) and new yearly parquet in the same tree
+    daily_dir = tmp_path / 'daily'
+    yearly_dir = tmp_path / 'yearly'
+    daily_dir.mkdir()
+    yearly_dir.mkdir()
+    pd.DataFrame({'sdate': ['2019-12-30'] * 2, 'stime': ['00:00', '00:30'], 'level': [1.0, 2.0]}
+                 ).to_csv(daily_dir / 'station_239_20191230.csv', index=False)
+    pd.DataFrame({'sdate': ['2019-12-29', '2019-12-30', '2019-12-31'], 'stime': ['00:00'] * 3,
+                  'level': [3.0, 4.0, 5.0]}).to_parquet(yearly_dir / 'station_240_2019.parquet', index=False)
+
+    for date_str in ('2019-12-30', '20191230'):
+        df = load_hydro_data(date_str, hydrometr_dir=str(tmp_path))
+        assert len(df) == 3
+        assert set(df['sdate']) == {'2019-12-30'}
+        assert sorted(df['level']) == [1.0, 2.0, 4.0]
+        assert (df['timestamp'].dt.date.astype(str) == '2019-12-30').all()
+
+    assert load_hydro_data('2019-12-28', hydrometr_dir=str(tmp_path)) is None
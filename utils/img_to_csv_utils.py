@@ -10,38 +10,104 @@
 
     Functions:
 
-    - enhance_image_for_ocr: Enhances contrast and sharpness of an image to improve OCR accuracy.
+    - otsu_threshold: Computes the Otsu binarization threshold of a grayscale image.
+    - enhance_image_for_ocr: Enhances contrast and sharpness of an image, limits its size and binarizes it 
+      (Otsu threshold) to improve OCR accuracy and speed.
     - extract_protok_data: Extracts hourly discharge values and associated date from a scanned 
       protocol image.
+    - extract_protok_batch: Same as extract_protok_data for a list of images, OCR-ed with a single 
+      Tesseract call (multi-page TIFF).
 
     Author: Lorenzo Cane - DBL E&E Area Consultant  
     Last modified: 20/06/2025
 """
 import os
 import re
+import tempfile
 import pytesseract
-from PIL import Image, ImageEnhance, ImageFilter
+from PIL import Image, ImageEnhance, ImageFilter, ImageOps
 import pandas as pd
 
+#Tesseract settings: LSTM engine only, image treated as a single uniform block of text (table rows)
+TESSERACT_CONFIG = '--oem 1 --psm 6'
+#Date in the image file name (Protok_DD.MM.YYYY)
+_DATE_RE = re.compile(r"Protok_(\d{2})\.(\d{2})\.(\d{4})")
+#Decimal values in a table row (e.g. 12.5, 103.25)
+_VALUE_RE = re.compile(r'\d+\.\d{1,2}')
 
-def enhance_image_for_ocr(image_path):
+
+def otsu_threshold(img):
+    """
+        Compute the Otsu threshold of a grayscale image (gray level maximizing the between-class variance).
+
+        Parameters:
+        -----------
+        img : PIL.Image.Image
+            Grayscale ('L') image.
+
+        Returns:
+        --------
+        int
+            Gray level (0-255) separating background and text.
+    """
+    hist = img.histogram()
+    total = sum(hist)
+    sum_all = sum(level * count for level, count in enumerate(hist))
+    weight_bg, sum_bg = 0, 0
+    best_level, best_var = 0, -1.0
+    for level, count in enumerate(hist):
+        weight_bg += count
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += level * count
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        var_between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if var_between > best_var:
+            best_level, best_var = level, var_between
+    return best_level
+
+def enhance_image_for_ocr(image_path, max_height=1400, threshold=None, target_dpi=300):
     """
         Enhance image contrast and sharpness for better OCR performance.
+        Large images are downscaled (Tesseract runtime grows with the number of pixels) 
+        and the result is binarized.
 
         Parameters:
         -----------
         image_path : str
             Path to the image file.
+        max_height : int, optional
+            Maximum height in pixels, taller images are downscaled keeping the aspect ratio (default is 1400).
+        threshold : int, optional
+            Gray level (0-255) above which a pixel becomes white. If None, it is computed for each 
+            image with Otsu's method (default is None).
+        target_dpi : int, optional
+            Images scanned at a higher resolution (DPI read from the file) are downscaled to this 
+            resolution, the one Tesseract works best with (default is 300).
 
         Returns:
         --------
         PIL.Image.Image
-            Processed grayscale image optimized for OCR.
+            Processed black and white image optimized for OCR.
     """
-    img = Image.open(image_path).convert('L')  # grigio
+    img = Image.open(image_path)
+    dpi = img.info.get('dpi', (0, 0))[0]
+    img = img.convert('L')  # grigio
+    if dpi > target_dpi:
+        img = img.resize((round(img.width * target_dpi / dpi), round(img.height * target_dpi / dpi)), Image.LANCZOS)
+    if img.height > max_height:
+        img = img.resize((round(img.width * max_height / img.height), max_height), Image.LANCZOS)
+    img = ImageOps.autocontrast(img)
     enhancer = ImageEnhance.Contrast(img)
     img = enhancer.enhance(2)
     img = img.filter(ImageFilter.SHARPEN)
+    if threshold is None:
+        threshold = otsu_threshold(img)
+    img = img.point(lambda p: 255 if p > threshold else 0)
     return img
 
 def extract_protok_data(image_path):
@@ -61,18 +127,75 @@ def extract_protok_data(image_path):
         Only the first 24 valid rows are returned to exclude daily summaries.
     """
     img = enhance_image_for_ocr(image_path)
-    text = pytesseract.image_to_string(img, lang="eng")
+    text = pytesseract.image_to_string(img, lang="eng", config=TESSERACT_CONFIG)
+
+    return parse_protok_text(text, image_path)
+
+def extract_protok_batch(image_paths):
+    """
+        Extract hourly discharge data from several protocol images using a single OCR call.
+        Enhanced images are stacked in a temporary multi-page TIFF, so that Tesseract is started 
+        (and its model loaded) once per batch instead of once per image.
+
+        Parameters:
+        -----------
+        image_paths : list of str
+            Paths to the scanned protocol images (filenames must include date in format Protok_DD.MM.YYYY).
+
+        Returns:
+        --------
+        list of lists
+            Rows of all the images, in the same order as image_paths (see extract_protok_data).
+    """
+    #Images without a date in the name would be discarded anyway: do not OCR them
+    image_paths = [path for path in image_paths if _DATE_RE.search(os.path.basename(path))]
+    if not image_paths:
+        return []
+
+    images = [enhance_image_for_ocr(path) for path in image_paths]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tiff_path = os.path.join(tmp_dir, 'protok_batch.tif')
+        images[0].save(tiff_path, save_all=True, append_images=images[1:], compression='tiff_deflate')
+        text = pytesseract.image_to_string(tiff_path, lang="eng", config=TESSERACT_CONFIG)
+
+    #Tesseract ends each page with a form feed
+    pages = text.split('\f')
+    if len(pages) < len(image_paths):
+        raise ValueError(f'OCR returned {len(pages)} pages for {len(image_paths)} images')
+
+    rows = []
+    for page_text, image_path in zip(pages, image_paths):
+        rows.extend(parse_protok_text(page_text, image_path))
+    return rows
+
+def parse_protok_text(text, image_path):
+    """
+        Parse the OCR text of a protocol image into hourly discharge rows.
+
+        Parameters:
+        -----------
+        text : str
+            Text returned by Tesseract for the image.
+        image_path : str
+            Path to the scanned protocol image, used to read the date (Protok_DD.MM.YYYY).
 
-    date_match = re.search(r"Protok_(\d{2})\.(\d{2})\.(\d{4})", os.path.basename(image_path))
+        Returns:
+        --------
+        list of lists
+            A list of rows, each containing [date (YYYY-MM-DD), value1, value2, value3] (first 24 valid rows).
+    """
+    date_match = _DATE_RE.search(os.path.basename(image_path))
     if not date_match:
         return []
     date_str = f"{date_match.group(3)}-{date_match.group(2)}-{date_match.group(1)}"
 
     rows = []
     for line in text.splitlines():
-        match = re.findall(r'\d+\.\d{1,2}', line)
+        match = _VALUE_RE.findall(line)
         if len(match) >= 2:
-            rows.append([date_str] + match[:3])  # max 3 value per row
+            rows.append([date_str, *match[:3]])  # max 3 value per row
+            #Limit range to the 24 hourly data excluding last line (daily summary)
+            if len(rows) == 24:
+                break
 
-    #Limit range to the 24 hourly data excluding last line (daily summary)
-    return rows[:24]
\ No newline at end of file
+    return rows
\ No newline at end of file
@@ -7,6 +7,8 @@
 
     Functions:
     ----------
+    - create_session: Creates an HTTP session with connection pooling (keep-alive) and automatic retries.
+
     - get_station_id_basin_map: Retrieves a mapping of station IDs to their names and basins 
       from a given API endpoint.
 
@@ -14,6 +16,8 @@
 
     - save_daily_data: Saves a day's worth of water level data to a local file (CSV or Parquet).
 
+    - save_yearly_data: Saves all the records of a station for one year to a single local file (Parquet or CSV).
+
     - fetch_hidmet: (DOESN'T WORK) Scrapes water stage (in cm) from the Hidmet Serbian national meteorological 
       website and returns it as a DataFrame.
 
@@ -23,12 +27,43 @@
 
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from io import StringIO
 import os
+import re
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import xarray as xr
 
-def get_station_id_basin_map(url, placeholder_id = 237, option = 1):
+def create_session(pool_size=16, retries=5, backoff_factor=0.5):
+    '''
+        Create an HTTP session reusing TCP connections (keep-alive) across requests, with automatic retries.
+
+        Parameters:
+        -----------
+        pool_size : int, optional
+            Maximum number of connections kept open per host (default is 16). Should be at least 
+            the number of threads sharing the session.
+        retries : int, optional
+            Maximum number of retries for failed requests (default is 5).
+        backoff_factor : float, optional
+            Backoff factor between retries in seconds (default is 0.5).
+
+        Returns:
+        --------
+        requests.Session
+            Configured session, can be shared among threads.
+    '''
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=(500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def get_station_id_basin_map(url, placeholder_id = 237, option = 1, session=None):
     '''
         Fetch data from the given url API, returns a mapping of station IDs to station basin and station name.
 
@@ -40,6 +75,9 @@ def get_station_id_basin_map(url, placeholder_id = 237, option = 1):
             ID of a known station to use in the request (default is 237).
         option : int, optional
             Option parameter for the API (default is 1).
+        session : requests.Session, optional
+            Session used to send the request (see create_session). If None, a new connection is 
+            opened for the request (default is None).
 
         Returns:
         --------
@@ -51,8 +89,9 @@ def get_station_id_basin_map(url, placeholder_id = 237, option = 1):
     url = url + "?" + "id_station=" + str(placeholder_id) + "&option=" + str(option)
     #print(f'Fetching data from: {url}')
     #Try to get API from the given station
+    http = session if session is not None else requests
     try:
-        resp = requests.get(url)
+        resp = http.get(url)
         #Give feedback on query requests
         resp.raise_for_status()
         #Save data into json
@@ -76,7 +115,7 @@ def get_station_id_basin_map(url, placeholder_id = 237, option = 1):
     except ValueError as e:
         print(f'Error while parsing JSON data of station {placeholder_id}: {e} \nTry with a different placeholder_id')
 
-def fetch_hydrometr_data(url, station_id, date):
+def fetch_hydrometr_data(url, station_id, date, session=None):
     '''
         Fetches daily hydrometric measurements for a specific station and date.
 
@@ -88,6 +127,9 @@ def fetch_hydrometr_data(url, station_id, date):
             The station ID to query.
         date : datetime
             The date for which data is requested.
+        session : requests.Session, optional
+            Session used to send the request (see create_session). If None, a new connection is 
+            opened for the request (default is None).
 
         Returns:
         --------
@@ -101,15 +143,16 @@ def fetch_hydrometr_data(url, station_id, date):
     '''
     #Complete url
     url = url + "?" + "id_station=" + str(station_id) +"&sdate=" + date.strftime("%Y-%m-%d")
-    print(url)
+    #print(url)
     #params dict as named in the php
     params = {"id_station": station_id, "sdate": date.strftime("%Y-%m-%d")}
     #request response after API request
-    resp = requests.get(url, params=params)
+    http = session if session is not None else requests
+    resp = http.get(url, params=params)
     #HTTP error check
     resp.raise_for_status()
 
-    print(f'Data request from station {station_id} fetched and loaded into JSON file')
+    #print(f'Data request from station {station_id} fetched and loaded into JSON file')
     return resp.json()
     
 
@@ -136,31 +179,98 @@ def save_daily_data(data, station_id, date, data_dir,
         ValueError
             If the specified format is not supported.
     '''   
-    #Take data recording part of the dataset (no header)
-    df = pd.DataFrame(data["rec"])
-    #combine date and time into a single index
-    
-    #rename columns
-    df.rename(columns={"kota": "elev"}, inplace=True)
-    #Save into the selected format
+    #Save into the selected format (data recording part of the dataset, no header)
     if format == "csv":
+        df = pd.DataFrame(data["rec"])
+        #rename columns
+        df.rename(columns={"kota": "elev"}, inplace=True)
         file_name = f"station_{station_id}_{date.strftime('%Y%m%d')}.csv"
         save_path = os.path.join(data_dir, file_name)
         df.to_csv(save_path)
 
     elif format == "parquet":
+        #Arrow table built straight from the records (no pandas intermediate)
+        table = pa.Table.from_pylist(data["rec"])
+        #rename columns
+        table = table.rename_columns(["elev" if col == "kota" else col for col in table.column_names])
         file_name = f"station_{station_id}_{date.strftime('%Y%m%d')}.parquet"
         save_path = os.path.join(data_dir, file_name)
-        df.to_parquet(save_path)
+        pq.write_table(table, save_path, compression="zstd")
     else:
         raise ValueError (f'Format {format} cannot be selected, Please choose between "csv" and "parquet".')
     
+def save_yearly_data(records, station_id, year, data_dir, 
+                     format= "parquet"):
+    '''
+        Saves all the hydrometric records of a station for one year into a single file, instead of 
+        one small file per day. If the file already exists the new records are merged into it 
+        (duplicated sdate/stime rows are replaced by the new ones).
+
+        Parameters:
+        -----------
+        records : list of dict
+            Records ("rec" part of the JSON responses) collected over the year.
+        station_id : str or int
+            Station ID used for naming the file.
+        year : int
+            Year of the records, used for naming the file.
+        data_dir : str
+            Directory where the file will be saved.
+        format : str, optional
+            File format to use: "parquet" or "csv" (default is "parquet").
+
+        Returns:
+        --------
+        str
+            Path of the saved file.
+
+        Raises:
+        -------
+        ValueError
+            If the specified format is not supported.
+    '''
+    df = pd.DataFrame(records)
+    #rename columns
+    df.rename(columns={"kota": "elev"}, inplace=True)
+    #Numeric columns as numbers (as a CSV reader would infer them), date and time stay strings
+    for col in df.columns.difference(["sdate", "stime"]):
+        try:
+            df[col] = pd.to_numeric(df[col])
+        except (ValueError, TypeError):
+            pass
+
+    if format not in ("parquet", "csv"):
+        raise ValueError (f'Format {format} cannot be selected, Please choose between "parquet" and "csv".')
+    file_name = f"station_{station_id}_{year}.{format}"
+    save_path = os.path.join(data_dir, file_name)
+
+    #Keep the records of previous runs over the same year (new records win on the same sdate/stime)
+    if os.path.exists(save_path):
+        if format == "parquet":
+            old_df = pd.read_parquet(save_path)
+        else:
+            old_df = pd.read_csv(save_path, dtype={"sdate": str, "stime": str})
+        df = pd.concat([old_df, df], ignore_index=True)
+        df = df.drop_duplicates(subset=["sdate", "stime"], keep="last")
+        df = df.sort_values(["sdate", "stime"], ignore_index=True)
+
+    #Save into the selected format
+    if format == "parquet":
+        df.to_parquet(save_path, index=False, compression="zstd")
+    else:
+        df.to_csv(save_path, index=False)
+
+    return save_path
+
 ##################################################################################
 #STILL NOT WORKING
 #################################################################################
 
+#Text identifying the water stage table on the Hidmet page
+_HIDMET_TABLE_RE = re.compile(r"Vodostaj")
+
 
-def fetch_hidmet(hm_id, period, url = "https://www.hidmet.gov.rs/latin/osmotreni/nrt_tabela_grafik.php"): 
+def fetch_hidmet(hm_id, period, url = "https://www.hidmet.gov.rs/latin/osmotreni/nrt_tabela_grafik.php", session=None): 
     '''
         Scrapes water stage measurements from the Hidmet website for a given station and time period.
 
@@ -172,6 +282,9 @@ def fetch_hidmet(hm_id, period, url = "https://www.hidmet.gov.rs/latin/osmotreni
             Time period string as expected by the Hidmet URL (e.g., "1d", "7d", "30d").
         url : str, optional
             Base URL of the Hidmet data endpoint (default is the standard portal URL).
+        session : requests.Session, optional
+            Session used to send the request (see create_session). If None, a new connection is 
+            opened for the request (default is None).
 
         Returns:
         --------
@@ -188,11 +301,12 @@ def fetch_hidmet(hm_id, period, url = "https://www.hidmet.gov.rs/latin/osmotreni
     params = {"hm_id": hm_id, "period": period}
     complete_url = url + f'?hm_id={hm_id}&period={period}'
 
-    resp = requests.get(complete_url)
+    http = session if session is not None else requests
+    resp = http.get(complete_url)
     resp.raise_for_status()
 
-    # Parse all tables in the HTML
-    tables = pd.read_html(StringIO(resp.text))
+    # Parse only the water stage table in the HTML (lxml C parser)
+    tables = pd.read_html(StringIO(resp.text), flavor="lxml", match=_HIDMET_TABLE_RE)
 
     if not tables:
         raise ValueError("No table found on page")
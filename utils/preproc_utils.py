@@ -12,22 +12,32 @@
         Loads and concatenates hydrometric data for a specific date string from raw CSV files.
 
     - flat_ERA5_data:
-        Flattens ERA5 variable values (e.g., temperature, pressure) into tabular format for ML integration.
+        Flattens ERA5 variable values (e.g., temperature, pressure) into a (time, lat*lon) array for ML integration.
+
+    - flat_ERA5_records:
+        Same flattened values as a list of dictionaries (one per timestamp).
 
     - get_flat_index_to_coords:
         Returns a dictionary mapping flattened ERA5 grid indices to geographic coordinates (lat, lon).
 
+    - get_flat_coords_array:
+        Returns latitude and longitude of each flattened ERA5 grid index as two arrays.
+
     - tensor_ERA5_pytorch:
         Converts gridded ERA5 NetCDF files into PyTorch-ready tensors of shape (N, 1, H, W), 
-        where N is the number of time steps.
+        where N is the number of time steps (in memory, memory-mapped on disk or lazy).
 
     - filter_river_data:
-        Extracts and cleans hydrometric water level time series for a given station ID from raw CSV files.
+        Extracts and cleans hydrometric water level time series for a given station ID from raw CSV 
+        (daily) or Parquet (yearly) files.
 
     - rename_column:
         Renames a river column based on its metadata using a provided station map 
         (e.g., from ID to human-readable basin name).
 
+    - get_rename_map:
+        Precomputes the rename_column mapping for all stations (dict for DataFrame.rename).
+
     Dependancies:
     ------------
     - Python libraries (see requuirements.txt file)
@@ -38,7 +48,8 @@
     - This module assumes a 11x14 grid resolution for spatial data by default.
 '''
 
-import os
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 import xarray as xr
@@ -49,14 +60,16 @@ from tqdm import tqdm
 
 def load_hydro_data(date_str, hydrometr_dir='./hydrometrological_data'):
     '''
-        Load hydrometric CSV data for a specific date string from a directory structure.
+        Load hydrometric data for a specific date string from a directory structure.
+        Both the legacy daily CSV files (date stamp 'YYYYMMDD' in the file name) and the yearly parquet 
+        files ("station_<id>_<year>.parquet", filtered on the "sdate" column) are read.
 
         Parameters:
         ----------
             date_str: str
-                 Date in 'YYYY-MM-DD' or other substring format to match in filenames.
+                 Date in 'YYYY-MM-DD' or 'YYYYMMDD' format, or a prefix of them ('YYYY-MM', 'YYYYMM', 'YYYY').
             hydrometr_dir: str , OPT
-                Root directory containing CSV files of hydrometric measurements.
+                Root directory containing the files of hydrometric measurements.
 
         Returns:
         --------
@@ -64,22 +77,31 @@ def load_hydro_data(date_str, hydrometr_dir='./hydrometrological_data'):
             Concatenated dataframe of matched records with a timestamp column,
             or None if no files match.
     '''
-    matched_data = [] #array to store matched data based on date
-    
-    for root, dirs, files in os.walk(hydrometr_dir): #check all subdirs
-        for file in files:                           #check all files
-            if date_str in file and file.endswith('.csv'): #check file name and format
-                file_path = os.path.join(root, file)
-
-                try:
-                    df = pd.read_csv(file_path)
-                    df['timestamp'] = pd.to_datetime(df['sdate'] + " " + df['stime'])
-                    matched_data.append(df)
+    #Same key for file names (YYYYMMDD) and sdate values (YYYY-MM-DD)
+    key = date_str.replace('-', '')
+    #Files matching the date, in all subdirs (name pattern matched by the directory walker)
+    file_paths = sorted(Path(hydrometr_dir).rglob(f'*{key}*.csv'))
+    #Yearly files: the day is selected on the sdate column
+    file_paths += sorted(Path(hydrometr_dir).rglob(f'station_*_{key[:4]}.parquet'))
+
+    def read_one(file_path):
+        try:
+            if file_path.suffix == '.parquet':
+                df = pd.read_parquet(file_path)
+                df = df[df['sdate'].str.replace('-', '').str.startswith(key)].reset_index(drop=True)
+            else:
+                df = pd.read_csv(file_path)
+            df['timestamp'] = pd.to_datetime(df['sdate'] + " " + df['stime'], format='ISO8601')
+            return df
+        except Exception as e:
+            print(f'Failed to read {file_path}: {e}')
+            return None
 
-                except Exception as e:
-                    print(f'Failed to read {file_path}: {e}')
+    #Files are independent: read them in parallel threads (the pandas parser releases the GIL)
+    with ThreadPoolExecutor() as executor:
+        matched_data = [df for df in executor.map(read_one, file_paths) if df is not None and not df.empty]
 
-    return pd.concat(matched_data, ignore_index=True) if matched_data else None
+    return pd.concat(matched_data, ignore_index=True, copy=False) if matched_data else None
 
 def flat_ERA5_data(file_path, variable_name, dimension=11*14):
     '''
@@ -92,39 +114,67 @@ def flat_ERA5_data(file_path, variable_name, dimension=11*14):
         variable_name: str
             Name of the ERA5 variable to extract.
         dimension : int , opt 
-            Expected spatial resolution (default 154 = 11x14 for lat x lon).
+            Expected spatial resolution (default 154 = 11x14 for lat x lon), a ValueError is raised if 
+            the grid size differs.
 
         Returns:
         --------
-        list[dict]: 
-            A list of dictionaries where each contains flattened variable values and a timestamp.
+        tuple:
+            - numpy.ndarray: 
+                Timestamps (datetime64[ns]) of shape (T,).
+            - numpy.ndarray: 
+                Flattened values (float32, C-contiguous) of shape (T, dimension), column idx 
+                matching index_to_coord.
     '''
-    #Array to save partial records
-    file_record = []
     #Open file
     try:
         ds = xr.open_dataset(file_path)
     except Exception as e:
         print(f'Failed to open {file_path}: {e}')
+        raise
     
-    #Look for variable 
-    if variable_name not in ds:
-        raise ValueError(f"Variable '{variable_name}' not found in dataset.")
-    
-    var_data = ds[variable_name] #shape: (time, lat , long)
+    with ds:
+        #Look for variable 
+        if variable_name not in ds:
+            raise ValueError(f"Variable '{variable_name}' not found in dataset.")
+        
+        var_data = ds[variable_name] #shape: (time, lat , long)
+
+        #Check grid size before reading any value
+        n_lat, n_lon = var_data.shape[-2], var_data.shape[-1]
+        if n_lat * n_lon != dimension:
+            raise ValueError(f'Record dimension is {n_lat * n_lon} ({n_lat}x{n_lon}) while expected dimension is {dimension}')
 
-    #Flat data iterating over time
-    time_values = ds["valid_time"].values
-    for i,t in enumerate(time_values): 
-        flat = var_data.isel(valid_time=i).values.flatten() #FLATTEN move on lat then long (north 2 south , then west 2 east)
-        record = {"datetime" : pd.to_datetime(t)}
-        record.update({f"{variable_name}_{j}": flat[j] for j in range(len(flat))})
-        file_record.append(record)
+        #Flat data in one go: FLATTEN move on lat then long (north 2 south , then west 2 east)
+        timestamps = pd.to_datetime(ds["valid_time"].values).to_numpy()
+        values = np.ascontiguousarray(var_data.values.reshape(var_data.shape[0], -1), dtype=np.float32) #shape: (time, lat*long)
 
-    if (len(flat) != dimension):
-        print(f'ALERT: record dimension is {len(flat)} while expected dimension is {dimension}')
+    return timestamps, values
+
+def flat_ERA5_records(file_path, variable_name, dimension=11*14):
+    '''
+        Same as flat_ERA5_data, with the output as a list of dictionaries (one per timestamp), 
+        for code still using the record layout.
+
+        Parameters:
+        -----------
+        file_path : str
+            Path to the NetCDF file (.nc).
+        variable_name: str
+            Name of the ERA5 variable to extract.
+        dimension : int , opt 
+            Expected spatial resolution (default 154 = 11x14 for lat x lon).
 
-    return file_record
+        Returns:
+        --------
+        list[dict]: 
+            A list of dictionaries where each contains flattened variable values ({variable_name}_{idx}) 
+            and a timestamp ('datetime').
+    '''
+    timestamps, values = flat_ERA5_data(file_path, variable_name, dimension)
+    df = pd.DataFrame(values, columns=[f"{variable_name}_{j}" for j in range(values.shape[1])])
+    df.insert(0, "datetime", pd.to_datetime(timestamps))
+    return df.to_dict(orient="records")
               
 
 def get_flat_index_to_coords(ds):
@@ -145,16 +195,35 @@ def get_flat_index_to_coords(ds):
     lats = ds.latitude.values
     lons = ds.longitude.values
     
-    mapping = {}
-    idx = 0
-    for lat in lats:
-        for lon in lons:
-            mapping[idx] = (lat, lon)
-            idx += 1
+    #Grid coordinates in flattening order: lat then long (row-major)
+    lat_grid, lon_grid = np.meshgrid(lats, lons, indexing='ij')
+    mapping = dict(enumerate(zip(lat_grid.ravel().tolist(), lon_grid.ravel().tolist())))
     return mapping
 
+def get_flat_coords_array(ds):
+    """
+        Returns latitude and longitude of each flattened index of a variable as two arrays 
+        (lat[idx], lon[idx]), same ordering as get_flat_index_to_coords.
+    
+        Parameters:
+        -----------
+        ds: xarray.Dataset
+            The dataset containing the variable.
+        
+        Returns:
+        --------
+        tuple of numpy.ndarray: 
+            Latitude and longitude (float32) of each flattened index.
+    """
+    lats = ds.latitude.values
+    lons = ds.longitude.values
 
-def tensor_ERA5_pytorch(main_dir, variable):
+    lat_flat = np.repeat(lats, lons.size).astype(np.float32)
+    lon_flat = np.tile(lons, lats.size).astype(np.float32)
+    return lat_flat, lon_flat
+
+
+def tensor_ERA5_pytorch(main_dir, variable, lazy=False, out_path=None):
     """
         Converts ERA5 variable data from multiple NetCDF files into PyTorch-compatible tensor format.
         (Automatic scan of subdirs is implemented).
@@ -165,51 +234,53 @@ def tensor_ERA5_pytorch(main_dir, variable):
             Root directory containing NetCDF files.
         variable: str
             Name of the ERA5 variable to extract.
+        lazy: bool, opt
+            If True, return a dask array read on demand (batches can be streamed without loading 
+            the whole tensor). Files stay open while the array is in use (default False).
+        out_path: str, opt
+            If given, the tensor is written into a memory-mapped .npy file at this path instead of RAM 
+            (reopen it with np.load(out_path, mmap_mode='r')). Ignored if lazy (default None).
 
         Returns:
         --------
         tuple:
-            - numpy.ndarray: 
-                Tensor of shape (N, 1, H, W) where N is the number of time steps.
+            - numpy.ndarray, numpy.memmap or dask.array.Array: 
+                Tensor of shape (N, 1, H, W) where N is the number of time steps (time ordered).
             - list[pandas.Timestamp]: 
                 Corresponding datetime objects for each time step.
     """
 
-    #empty array where to store  the results
-    tensors = []
-    timestamps = []
-
-    #Loop through all files
-    for root, dirs, files in os.walk(main_dir):
-        for file in files:
-            if file.endswith('.nc'):
-                file_path = os.path.join(root, file)
-                print(f'Processing file: {file_path}')
-                #Read dataset
-                ds = xr.open_dataset(file_path)
-                #Check for variable
-                if variable not in ds:
-                    continue
-                
-                #Time and variable values
-                time_vals = ds['valid_time'].values
-                var_vals = ds[variable].values #Still in shape : (time, lat, long)
-                
-                #Loop on time dime
-                for i in range(var_vals.shape[0]):
-                    #Create time slices
-                    grid = var_vals[i, : , : ] #shape : (lat, long)
-                    #tensor like grid
-                    grid_tensor = grid[np.newaxis, : , : ]  #shape : (1, lat, long)
-
-                    #Store grid in tensor and corresponding timestamp
-                    tensors.append(grid_tensor)
-                    timestamps.append(pd.to_datetime(time_vals[i]))       
-
-    #Create a PyTorch-friendly tensor (stack sequence of arrays along a new axis)
-    tensor = np.stack(tensors) #shape: (N, 1, H, W)
-
-    return tensor.astype(np.float32), timestamps
+    #All NetCDF files in main_dir and its subdirs
+    nc_files = sorted(Path(main_dir).rglob('*.nc'))
+    print(f'Processing {len(nc_files)} files in {main_dir}')
+
+    #Single lazy dataset: files are opened and read in parallel by dask, concatenated along time by xarray
+    ds = xr.open_mfdataset(nc_files, combine='by_coords', parallel=True, chunks={'valid_time': 744})
+    #Check for variable
+    if variable not in ds:
+        ds.close()
+        raise ValueError(f"Variable '{variable}' not found in dataset.")
+
+    var_data = ds[variable].data.astype(np.float32) #dask array, shape: (N, H, W)
+    timestamps = pd.to_datetime(ds['valid_time'].values).tolist()
+
+    if lazy:
+        return var_data[:, np.newaxis, :, :], timestamps #shape: (N, 1, H, W)
+
+    #(all files are closed when leaving the with block)
+    with ds:
+        #Create a PyTorch-friendly tensor allocated once (in RAM or on disk): each chunk (file block) is written in its slice
+        shape = (var_data.shape[0], 1, *var_data.shape[1:]) #shape: (N, 1, H, W)
+        if out_path is None:
+            tensor = np.empty(shape, dtype=np.float32)
+        else:
+            tensor = np.lib.format.open_memmap(out_path, mode='w+', dtype=np.float32, shape=shape)
+        var_data.store(tensor[:, 0])
+
+    if out_path is not None:
+        tensor.flush()
+
+    return tensor, timestamps
 
 
 def filter_river_data(main_dir, river_code, battery_treshold = 12.0):
@@ -221,7 +292,7 @@ def filter_river_data(main_dir, river_code, battery_treshold = 12.0):
         Parameters:
         -----------
         main_dir: str
-            Directory containing the CSV files for different stations.
+            Directory containing the CSV (daily) or Parquet (yearly) files for different stations.
         river_code: str 
             Unique identifier for the river station.
         battery_treshold: float, opt
@@ -230,29 +301,42 @@ def filter_river_data(main_dir, river_code, battery_treshold = 12.0):
         Returns:
         --------
         pandas.DataFrame or None: 
-            Filtered time series dataframe with datetime and level columns, or None if no data found.
+            Filtered time series dataframe with datetime and level columns (datetime sorted, no duplicates), 
+            or None if no data found.
     '''
     river_name = f'river{river_code}_level' #idx name
-    dfs = [] #final dataframe
-
-    #Loop throught all subdirs (ready for all subdirs structure)
-    for root, dirs, files in os.walk(main_dir):
-        for file in files:
-            #Find the right files
-            if file.endswith('.csv') and f'station_{river_code}_' in file:
-                file_path = os.path.join(root, file)
-                #Read csv
-                df = pd.read_csv(file_path)
-                df['datetime'] = pd.to_datetime(df['sdate'] + ' ' + df['stime'])
-                #Clean Dataset using battery level thr. and imposing level > 0
-                df = df[(df['battery'] >= battery_treshold) & (df['level'] >= 0)]
-                #Rename coloumn
-                df = df[['datetime', 'level']].rename(columns={'level': river_name})
-                #Store all data from the same river
-                dfs.append(df)
+    river_columns = ['sdate', 'stime', 'battery', 'level'] #columns needed from the raw files
+
+    #Find the right files, throught all subdirs (ready for all subdirs structure)
+    file_paths = sorted(path for path in Path(main_dir).rglob(f'*station_{river_code}_*') 
+                        if path.suffix in ('.csv', '.parquet'))
+
+    def read_one(file_path):
+        #Read csv or parquet (only the columns used below)
+        if file_path.suffix == '.csv':
+            df = pd.read_csv(file_path, usecols=river_columns)
+        else:
+            df = pd.read_parquet(file_path, columns=river_columns)
+        #ISO date and time (seconds optional): parsed by the fast path, no per-row format inference
+        df['datetime'] = pd.to_datetime(df['sdate'] + ' ' + df['stime'], format='ISO8601')
+        #Clean Dataset using battery level thr. and imposing level > 0 (mask on the raw arrays, 
+        #rows and columns selected in one copy)
+        keep = (df['battery'].to_numpy() >= battery_treshold) & (df['level'].to_numpy() >= 0)
+        df = df.loc[keep, ['datetime', 'level']]
+        #Rename coloumn (in place: the selection above is already a new frame)
+        df.rename(columns={'level': river_name}, inplace=True)
+        return df
+
+    #Files are independent: read them in parallel threads (map keeps the file order)
+    with ThreadPoolExecutor() as executor:
+        dfs = list(executor.map(read_one, file_paths)) #all data from the same river
 
     if dfs:
-        return pd.concat(dfs).drop_duplicates('datetime')
+        #Sort (stable: the first file read wins on duplicates) and drop repeated datetimes comparing neighbours
+        out = pd.concat(dfs, ignore_index=True, copy=False)
+        out.sort_values('datetime', kind='mergesort', inplace=True, ignore_index=True)
+        dt = out['datetime'].to_numpy()
+        return out[np.r_[True, dt[1:] != dt[:-1]]].reset_index(drop=True)
     else:
         print('DataFrame is empty.')
         return None
@@ -282,16 +366,46 @@ def rename_column(col, station_map):
             return name.replace(" ", "_")  # make it column-friendly
     return col  # fallback for datetime or unmatched
 
+def get_rename_map(station_map):
+    '''
+        Precompute the river column renaming of rename_column for all the stations at once, 
+        to be passed to DataFrame.rename(columns=...) (one dict lookup per column).
+
+        Parameters:
+        -----------
+        station_map : dict 
+            Dictionary mapping station ID to metadata including 'basin' name.
+
+        Returns:
+        --------
+        dict: 
+            Mapping from river column name (e.g., 'river001_level') to the cleaned basin name.
+    '''
+    return {f'river{station_id}_level': meta['basin'].replace(' ', '_') 
+            for station_id, meta in station_map.items()}
+
 
 def get_unit_longname(ds, variable):
     '''
+        Read unit and long name of an ERA5 variable from its attributes.
+        The dataset is passed already open, so it can be reused for all the variables.
+
+        Parameters:
+        -----------
+        ds: xarray.Dataset
+            Open dataset containing the variable.
+        variable: str
+            Name of the ERA5 variable.
+
+        Returns:
+        --------
+        tuple of str:
+            Unit and long name of the variable.
     '''
 
-    #Variable subset
-    subset = ds[variable].isel(valid_time = 0)
-    if subset is None:
-        raise ValueError(f'variable Subset is empty, not able to detect unit and long name')
-    unit = subset.attrs['units']
-    long_name =  subset.attrs['long_name']
+    #Attributes live on the variable: no data slice needed (KeyError if the variable is missing)
+    attrs = ds[variable].attrs
+    unit = attrs['units']
+    long_name =  attrs['long_name']
 
     return unit, long_name
\ No newline at end of file
@@ -2,13 +2,16 @@
 '''
 
 
+import os
+import hashlib
+import glob
 import pandas as pd
 import numpy as np
-import seaborn as sns
 import matplotlib.pyplot as plt
+from statsmodels.tsa.seasonal import seasonal_decompose, DecomposeResult
 
 
-def inspect_missing(df, plot=True, plot_title= ' Missing Value Heatmap', top_n = 10):
+def inspect_missing(df, plot=True, plot_title= ' Missing Value Heatmap', top_n = 10, max_rows = 1000, save_path = None):
     '''
         Inspect missing values in a DataFrame. Can generate summary plots.
     
@@ -22,6 +25,12 @@ def inspect_missing(df, plot=True, plot_title= ' Missing Value Heatmap', top_n =
             Title of the heatmap created if plot = true
         top_n : int, opt 
             Number of top columns with missing values to print (default : 10). 
+        max_rows : int, opt 
+            Maximum number of rows drawn in the heatmap, consecutive rows are averaged in blocks 
+            (fraction of missing values) above it (default : 1000). 
+        save_path : str, opt
+            If given, the heatmap is saved to this path and closed instead of being shown 
+            (needed with non-interactive backends, e.g. Agg) (default : None).
     
         Returns:
         -------
@@ -29,8 +38,10 @@ def inspect_missing(df, plot=True, plot_title= ' Missing Value Heatmap', top_n =
                 Missing value counts per column.   
     '''
 
+    #Missing mask computed once (used for counts and plot)
+    mask = df.isna().to_numpy(dtype=bool)
     #Total number if missing
-    total_missing = df.isnull().sum()
+    total_missing = pd.Series(mask.sum(axis=0), index=df.columns)
     #Check if there are missing
     missing_check = total_missing[total_missing > 0]
 
@@ -42,10 +53,71 @@ def inspect_missing(df, plot=True, plot_title= ' Missing Value Heatmap', top_n =
     print(missing_check.sort_values(ascending=False).head(top_n))
 
     if plot:
+        #Average blocks of consecutive rows (fraction of missing values) to draw at most max_rows rows
+        step = max(1, -(-mask.shape[0] // max_rows))
+        mask_plot = np.add.reduceat(mask, np.arange(0, mask.shape[0], step), axis=0, dtype=np.float32)
+        mask_plot /= np.diff(np.r_[np.arange(0, mask.shape[0], step), mask.shape[0]])[:, np.newaxis]
+
         plt.figure(figsize=(12,6))
-        sns.heatmap(df.isnull(), cbar=False, yticklabels=False)
+        plt.imshow(mask_plot, aspect='auto', interpolation='nearest', cmap='gray_r', vmin=0, vmax=1)
+        tick_step = max(1, len(df.columns) // 40) #readable labels on wide frames
+        plt.xticks(range(0, len(df.columns), tick_step), df.columns[::tick_step], rotation=90)
+        plt.yticks([])
         plt.title(plot_title)
         plt.xlabel('Columns')
-        plt.show()
+        if save_path is not None:
+            plt.savefig(save_path)
+            plt.close()
+            print(f'Missing value heatmap saved to {save_path}')
+        else:
+            plt.show()
     
     return missing_check
+
+
+def cached_seasonal_decompose(series, period, cache_dir='./cache', name='series'):
+    '''
+        Seasonal decomposition of a time series, with results cached on disk.
+        The cache key is a hash of the series values, index and period, so the decomposition 
+        is recomputed only when the data change. Only the latest decomposition of each name is kept 
+        (older cache files of the same name are removed when a new one is written).
+    
+        Parameters:
+        -----------
+        series:  pandas.Series
+            Time series to decompose.
+        period: int
+            Period of the series (see statsmodels seasonal_decompose).
+        cache_dir: str, opt
+            Directory where decompositions are stored (default : './cache').
+        name : str, opt 
+            Name used in the cache file name (default : 'series'). 
+    
+        Returns:
+        -------
+            decomposition:  statsmodels.tsa.seasonal.DecomposeResult
+                Trend, seasonal and residual components (plot() can be used as usual).   
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+
+    #Content-based key
+    hasher = hashlib.blake2s(digest_size=8)
+    hasher.update(np.ascontiguousarray(series.to_numpy()).tobytes())
+    hasher.update(np.ascontiguousarray(series.index.to_numpy()).tobytes())
+    hasher.update(str(period).encode())
+    cache_path = os.path.join(cache_dir, f'decomp_{name}_{hasher.hexdigest()}.npz')
+
+    if os.path.exists(cache_path):
+        print(f'Seasonal decomposition loaded from {cache_path}')
+        with np.load(cache_path) as cached:
+            components = {key: pd.Series(cached[key], index=series.index, name=key) 
+                          for key in ('seasonal', 'trend', 'resid')}
+        return DecomposeResult(series, components['seasonal'], components['trend'], components['resid'])
+
+    decomposition = seasonal_decompose(series, period=period)
+    #Stale entries of the same name (older data): the cache holds one file per name
+    for old_path in glob.glob(os.path.join(cache_dir, f'decomp_{glob.escape(name)}_' + '?' * 16 + '.npz')):
+        os.remove(old_path)
+    np.savez(cache_path, seasonal=np.asarray(decomposition.seasonal), 
+             trend=np.asarray(decomposition.trend), resid=np.asarray(decomposition.resid))
+    return decomposition